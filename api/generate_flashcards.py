@@ -1,37 +1,106 @@
 # # api/generate_flashcards.py
-# import json
+# import orjson
 # import io
 # import os
 # import re
 # import base64
-# from openai import OpenAI
+# import asyncio
+# import hashlib
+# import functools
+# import queue
+# import tempfile
+# import threading
+# from collections import OrderedDict
+# import httpx
+# from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 # from typing import List
-# import pdfplumber
+# import pypdfium2 as pdfium
+# import tiktoken
 # from http.server import BaseHTTPRequestHandler
 
-# from pydantic import BaseModel, Field
+# try:
+#     from docx import Document
+# except ImportError:
+#     Document = None
+# try:
+#     from pptx import Presentation
+# except ImportError:
+#     Presentation = None
+
+# from pydantic import BaseModel, Field, ValidationError
 # import logging
 # logger = logging.getLogger(__name__)
 # logger.setLevel(logging.INFO)  
 # # ----- Pydantic models -----
 # class Flashcard(BaseModel):
-#     question: str = Field(description="The question on the flashcard")
-#     answer: str = Field(description="The answer on the flashcard")
+#     question: str = Field(default="", description="The question on the flashcard")
+#     answer: str = Field(default="", description="The answer on the flashcard")
 
 # class FlashcardList(BaseModel):
 #     flashcards: List[Flashcard] = Field(description="List of flashcards")
 
 
 # # ----- JSON + Parsing Helpers -----
+# _TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
 # def clean_json_output(text: str):
 #     """Fix common JSON issues like trailing commas before parsing."""
-#     return re.sub(r",(\s*[}\]])", r"\1", text)
+#     return _TRAILING_COMMA_RE.sub(r"\1", text)
+
+# def normalize_flashcards(cards):
+#     """Turn parsed Flashcard models into response dicts, dropping cards without a question."""
+#     return [
+#         {"question": c.question.strip(), "answer": c.answer.strip() or "Answer not provided in text."}
+#         for c in cards
+#         if c.question.strip()
+#     ]
+
+# class FlashcardStreamParser:
+#     """Slice complete flashcard objects out of a JSON response as it streams in.
+
+#     Tracks brace depth (ignoring braces inside strings); every object that closes
+#     at depth 2, i.e. inside {"flashcards": [...]}, is validated as a Flashcard.
+#     """
+#     def __init__(self):
+#         self.buffer = ""
+#         self.depth = 0
+#         self.in_string = False
+#         self.escaped = False
+#         self.start = None
+
+#     def feed(self, text):
+#         pos = len(self.buffer)
+#         self.buffer += text
+#         cards = []
+#         for i in range(pos, len(self.buffer)):
+#             ch = self.buffer[i]
+#             if self.in_string:
+#                 if self.escaped:
+#                     self.escaped = False
+#                 elif ch == "\\":
+#                     self.escaped = True
+#                 elif ch == '"':
+#                     self.in_string = False
+#             elif ch == '"':
+#                 self.in_string = True
+#             elif ch == "{":
+#                 self.depth += 1
+#                 if self.depth == 2:
+#                     self.start = i
+#             elif ch == "}":
+#                 if self.depth == 2 and self.start is not None:
+#                     try:
+#                         cards.append(Flashcard.model_validate_json(self.buffer[self.start:i + 1]))
+#                     except ValidationError:
+#                         pass
+#                     self.start = None
+#                 self.depth -= 1
+#         return normalize_flashcards(cards)
 
 # def safe_parse_flashcards(flashcards_list):
 #     """Ensure flashcards always have 'question' and 'answer' fields."""
-#     repaired = []
-#     if hasattr(flashcards_list, "flashcards"): 
-#          flashcards = flashcards_list.flashcards
+#     if hasattr(flashcards_list, "flashcards"):  # Pydantic model case
+#         return normalize_flashcards(flashcards_list.flashcards)
 #     elif isinstance(flashcards_list, dict): 
 #          flashcards = flashcards_list.get("flashcards", [])
 #     elif isinstance(flashcards_list, list):  # Already a list
@@ -39,23 +108,18 @@
 #     else:
 #         return []
 
-#     for c in flashcards:
-#         if isinstance(c, dict):
-#             q = c.get("question", "").strip()
-#             a = c.get("answer", "").strip() or "Answer not provided in text."
-#         else:  # Pydantic model case
-#             q = getattr(c, "question", "").strip()
-#             a = getattr(c, "answer", "").strip() or "Answer not provided in text."
-
-#         if q and a:
-#              repaired.append({"question": q, "answer": a})
-#     return repaired
+#     # Single pass, one strip per field
+#     return [
+#         {"question": q, "answer": (c.get("answer") or "").strip() or "Answer not provided in text."}
+#         for c in flashcards
+#         if isinstance(c, dict) and (q := (c.get("question") or "").strip())
+#     ]
 
 # def parse_with_json_fallback(raw_output: str):
 #     """Fallback: force JSON.loads."""
 #     try:
 #         cleaned = clean_json_output(raw_output)
-#         data = json.loads(cleaned)
+#         data = orjson.loads(cleaned)
 #         return safe_parse_flashcards(data)
 #     except Exception as e:
 #         print(f"⚠️ JSON fallback failed: {e}")
@@ -63,14 +127,10 @@
 
 # def try_parse_flashcards(raw_output: str):
 #     """Try Pydantic parsing first, then fallback to cleaned JSON."""
-#     parser = PydanticOutputParser(pydantic_object=FlashcardList)
 #     try:
-#         cleaned = clean_json_output(raw_output)
-#         parsed = parser.parse(cleaned)
-#         if not getattr(parsed, "flashcards", None):
-#             raise ValueError("Parsed object missing flashcards")
-#         return safe_parse_flashcards(parsed)
-#     except Exception as e:
+#         parsed = FlashcardList.model_validate_json(clean_json_output(raw_output))
+#         return normalize_flashcards(parsed.flashcards)
+#     except ValidationError as e:
 #         print(f"⚠️ Parser failed, using JSON fallback: {e}")
 #         return parse_with_json_fallback(raw_output)
 
@@ -79,10 +139,27 @@
 
 
 # # ----- Text extraction -----
+# def _page_text(pdf, i):
+#     # PDFium reports line breaks as CRLF; normalize so paragraph splitting sees "\n\n"
+#     return pdf[i].get_textpage().get_text_range().replace("\r\n", "\n")
+
+# def _pages_text(pdf):
+#     """Append the UTF-8 text of every page to one buffer, one line break per page."""
+#     buf = bytearray()
+#     for i in range(len(pdf)):
+#         text = _page_text(pdf, i)
+#         if text:
+#             buf += text.encode("utf-8")
+#             buf.append(0x0A)
+#     return buf
+
 # def extract_text_from_pdf(file_content, max_pages=100):
 #     try:
-#         with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-#             total_pages = len(pdf.pages)
+#         # Opening only reads the xref/page tree, so oversized uploads are
+#         # rejected before any page is parsed
+#         pdf = pdfium.PdfDocument(file_content)
+#         try:
+#             total_pages = len(pdf)
 #             if total_pages > max_pages:
 #                 return {
 #                     "error": "document_too_long",
@@ -90,7 +167,9 @@
 #                     "page_count": total_pages,
 #                     "max_allowed": max_pages
 #                 }
-#             return "\n".join([page.extract_text() or "" for page in pdf.pages])
+#             return _pages_text(pdf).decode("utf-8")
+#         finally:
+#             pdf.close()
 #     except Exception as e:
 #         return {
 #             "error": "pdf_extraction_failed",
@@ -99,34 +178,36 @@
 
 # def extract_text_from_docx(file_content):
 #     try:
-#         from docx import Document
+#         if Document is None:
+#             raise ImportError("python-docx is not installed")
 #         doc = Document(io.BytesIO(file_content))
-#         return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+#         # para.text is rebuilt from the runs on every access, so read it once
+#         return "\n".join(text for para in doc.paragraphs if (text := para.text).strip())
 #     except Exception as e:
 #         return {
 #             "error": "docx_extraction_failed",
 #             "message": f"Error reading DOCX: {str(e)}"
 #         }
-# def filter_valid_flashcards(flashcards):
-#     valid = []
-#     for item in flashcards:
-#         if isinstance(item, dict):
-#             q = item.get("question", "").strip()
-#             a = item.get("answer", "").strip()
-#             if q and a:
-#                 valid.append({"question": q, "answer": a})
-#     return valid
-    
+
+# def _iter_shape_text(shapes):
+#     """Yield the non-empty text of text frames and table cells, descending into groups."""
+#     for shape in shapes:
+#         if shape.has_text_frame:
+#             if text := shape.text_frame.text:
+#                 yield text
+#         elif shape.has_table:
+#             for cell in shape.table.iter_cells():
+#                 if text := cell.text:
+#                     yield text
+#         elif hasattr(shape, "shapes"):  # Group shape
+#             yield from _iter_shape_text(shape.shapes)
+
 # def extract_text_from_pptx(file_content):
 #     try:
-#         from pptx import Presentation
+#         if Presentation is None:
+#             raise ImportError("python-pptx is not installed")
 #         prs = Presentation(io.BytesIO(file_content))
-#         text = []
-#         for slide in prs.slides:
-#             for shape in slide.shapes:
-#                 if hasattr(shape, "text"):
-#                     text.append(shape.text)
-#         return "\n".join(text)
+#         return "\n".join(text for slide in prs.slides for text in _iter_shape_text(slide.shapes))
 #     except Exception as e:
 #         return {
 #             "error": "pptx_extraction_failed",
@@ -135,91 +216,420 @@
 
 
 # # ----- Flashcard generation -----
-
-# def generate_flashcards(text, api_key):
-#     client = OpenAI(api_key=api_key)
-#     prompt_template =  """You are a flashcard generator for theory-based subjects.
-#   Output a valid JSON object with a key "flashcards" containing a list of flashcards.
+# MODEL = "gpt-4o"
+# MAX_CONCURRENT_REQUESTS = 16
+# # Bump whenever SYSTEM_PROMPT changes so cached flashcards from the old prompt are not reused
+# PROMPT_VERSION = 2
+
+# # Static instructions go in the system message and the chunk text goes last, so
+# # every request shares the same prefix for OpenAI's automatic prompt caching.
+# # The output shape is enforced by FLASHCARD_RESPONSE_FORMAT, so the prompt only
+# # describes the content.
+# SYSTEM_PROMPT = """You are a flashcard generator for theory-based subjects.
 # Generate as many flashcards as possible (aim for at least 30 if content allows)
-# Each flashcard must have:
-#   - "question": a clear, concise question (string)
-#   - "answer": a 2–3 sentence explanatory answer (string)
+# Each flashcard has a clear, concise question and a 2–3 sentence explanatory answer.
 # Stay strictly factual, based only on the provided text.
-# If the text contains no usable information, output {"flashcards": []}.
-# Do not explain, apologize, or return any text outside the JSON object.
-
-# Text:
+# If the text contains no usable information, return an empty list of flashcards.
 # """
+# SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# # OpenAI structured outputs: the model is constrained to exactly this FlashcardList
+# # shape (strict mode needs every field required and no extra properties).
+# FLASHCARD_RESPONSE_FORMAT = {
+#     "type": "json_schema",
+#     "json_schema": {
+#         "name": "flashcard_list",
+#         "strict": True,
+#         "schema": {
+#             "type": "object",
+#             "properties": {
+#                 "flashcards": {
+#                     "type": "array",
+#                     "items": {
+#                         "type": "object",
+#                         "properties": {
+#                             "question": {"type": "string"},
+#                             "answer": {"type": "string"},
+#                         },
+#                         "required": ["question", "answer"],
+#                         "additionalProperties": False,
+#                     },
+#                 },
+#             },
+#             "required": ["flashcards"],
+#             "additionalProperties": False,
+#         },
+#     },
+# }
+
+# # Clients are reused across warm invocations so each request skips client/connection
+# # setup. Their connection pools are bound to the loop they run on, so every request
+# # thread submits its work to one long-lived loop running in a daemon thread rather
+# # than starting a fresh loop from asyncio.run.
+# _EVENT_LOOP = asyncio.new_event_loop()
+# threading.Thread(target=_EVENT_LOOP.run_forever, name="flashcards-event-loop", daemon=True).start()
+
+# @functools.lru_cache(maxsize=4)
+# def get_client(api_key):
+#     # Size the keep-alive pool to the chunk fan-out so every concurrent request
+#     # can reuse a warm TLS connection on the next invocation
+#     limits = httpx.Limits(
+#         max_connections=MAX_CONCURRENT_REQUESTS,
+#         max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+#     )
+#     return AsyncOpenAI(api_key=api_key, http_client=DefaultAsyncHttpxClient(limits=limits))
+
+# # Two-level cache of chunk key -> ((question, answer), ...) so re-uploaded material
+# # skips the LLM: an in-process LRU in front of one JSON file per chunk on disk.
+# # /tmp is the writable (ephemeral) filesystem on Vercel/Lambda.
+# CHUNK_CACHE_SIZE = 1024
+# CACHE_DIR = os.environ.get("FLASHCARD_CACHE_DIR", "/tmp/flashcard_cache")
+# CACHE_DIR_MAX_BYTES = 64 * 1024 * 1024  # Lambda's /tmp is 512 MB by default
+# _CHUNK_CACHE = OrderedDict()
+
+# def _chunk_key(chunk):
+#     return hashlib.blake2b(f"{MODEL}|{PROMPT_VERSION}|{chunk}".encode("utf-8"), digest_size=16).hexdigest()
+
+# def _cache_path(key):
+#     return os.path.join(CACHE_DIR, f"{key}.json")
+
+# def _remember(key, cards):
+#     _CHUNK_CACHE[key] = cards
+#     _CHUNK_CACHE.move_to_end(key)
+#     if len(_CHUNK_CACHE) > CHUNK_CACHE_SIZE:
+#         _CHUNK_CACHE.popitem(last=False)
+
+# def _cache_get(key):
+#     cached = _CHUNK_CACHE.get(key)
+#     if cached is not None:
+#         _CHUNK_CACHE.move_to_end(key)
+#         return cached
+#     path = _cache_path(key)
+#     try:
+#         with open(path, "rb") as f:
+#             parsed = FlashcardList.model_validate_json(f.read())
+#     except (OSError, ValidationError):
+#         return None
+#     try:
+#         # Trimming drops the oldest mtimes first, so a read counts as a use
+#         os.utime(path)
+#     except OSError:
+#         pass
+#     cached = tuple((c.question, c.answer) for c in parsed.flashcards)
+#     _remember(key, cached)
+#     return cached
+
+# def _trim_cache_dir():
+#     """Delete the least recently used files until CACHE_DIR fits in CACHE_DIR_MAX_BYTES."""
+#     entries = []
+#     with os.scandir(CACHE_DIR) as it:
+#         for entry in it:
+#             # Temp files belong to writes still in flight
+#             if not entry.name.endswith(".json"):
+#                 continue
+#             try:
+#                 st = entry.stat()
+#             except FileNotFoundError:
+#                 continue
+#             entries.append((st.st_mtime, st.st_size, entry.path))
+#     total = sum(size for _, size, _ in entries)
+#     for _, size, path in sorted(entries):
+#         if total <= CACHE_DIR_MAX_BYTES:
+#             break
+#         try:
+#             os.remove(path)
+#         except FileNotFoundError:
+#             pass
+#         total -= size
 
-#     CHARS_PER_TOKEN = 4  
-#     MAX_INPUT_TOKENS = 6000
-#     chunk_size = MAX_INPUT_TOKENS * CHARS_PER_TOKEN  
-    
-#     chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-#     all_flashcards = [] 
-    
-#     for i, chunk in enumerate(chunks, 1):
-#         if not chunk.strip():
-#             continue
-            
+# def _cache_put(key, flashcards):
+#     _remember(key, tuple((c["question"], c["answer"]) for c in flashcards))
+#     try:
+#         os.makedirs(CACHE_DIR, exist_ok=True)
+#         # A unique temp file per write, so threads storing the same key never share one
+#         fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
 #         try:
+#             with os.fdopen(fd, "wb") as f:
+#                 f.write(orjson.dumps({"flashcards": flashcards}))
+#             os.replace(tmp_path, _cache_path(key))
+#         except OSError:
+#             os.unlink(tmp_path)
+#             raise
+#         _trim_cache_dir()
+#     except OSError as e:
+#         logger.warning(f"Could not write flashcard cache entry {key}: {e}")
+
+# MAX_INPUT_TOKENS = 6000
+# CHARS_PER_TOKEN = 4  # Fallback estimate when the tokenizer cannot be loaded
+
+# @functools.lru_cache(maxsize=None)
+# def get_encoding():
+#     """Return the model's tokenizer, or None if it cannot be loaded.
+
+#     A failure is cached like a success, so the BPE download is attempted
+#     once per process rather than on every request.
+#     """
+#     try:
+#         return tiktoken.encoding_for_model(MODEL)
+#     except Exception as e:
+#         # tiktoken downloads its BPE file on first use, which can fail offline
+#         logger.warning(f"Tokenizer unavailable, assuming {CHARS_PER_TOKEN} chars per token: {e}")
+#         return None
+
+# # Load the tokenizer during the Lambda init phase instead of on the first request
+# if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+#     get_encoding()
+
+# def chunk_char_budget(text):
+#     """Chunk size in characters so a chunk of `text` holds about MAX_INPUT_TOKENS tokens.
+
+#     Uses this document's own chars-per-token ratio, so token-dense text (code,
+#     non-English) gets smaller chunks and sparse text larger ones.
+#     """
+#     encoding = get_encoding()
+#     tokens = len(encoding.encode(text, disallowed_special=())) if encoding else 0
+#     if not tokens:
+#         return MAX_INPUT_TOKENS * CHARS_PER_TOKEN
+#     return max(1, MAX_INPUT_TOKENS * len(text) // tokens)
+
+# _SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+# def _iter_paragraphs(text):
+#     """Same pieces as text.split("\n\n"), without building the whole list up front."""
+#     start = 0
+#     while (end := text.find("\n\n", start)) != -1:
+#         yield text[start:end]
+#         start = end + 2
+#     yield text[start:]
+
+# def iter_chunks_by_sentence(text, target):
+#     """Yield chunks of at most `target` chars split on paragraph/sentence boundaries.
+
+#     Blank paragraphs and sentences are dropped, so every chunk has real content.
+#     Sentences are collected in a list and joined once per chunk, rather than
+#     re-copying the growing chunk string for every sentence.
+#     """
+#     parts = []
+#     size = 0
+#     for para in _iter_paragraphs(text):
+#         sep = "\n\n"
+#         for sentence in _SENTENCE_SPLIT_RE.split(para):
+#             if not sentence.strip():
+#                 continue
+#             # A single sentence longer than the budget has to be cut
+#             while len(sentence) > target:
+#                 if parts:
+#                     yield "".join(parts)
+#                     parts, size = [], 0
+#                 if sentence[:target].strip():
+#                     yield sentence[:target]
+#                 sentence = sentence[target:]
+#             if not sentence.strip():
+#                 continue
+#             if parts and size + len(sep) + len(sentence) > target:
+#                 yield "".join(parts)
+#                 parts, size = [], 0
+#             if parts:
+#                 parts.append(sep)
+#                 size += len(sep)
+#             parts.append(sentence)
+#             size += len(sentence)
+#             sep = " "
+#     if parts:
+#         yield "".join(parts)
+
+# MIN_UNIQUE_WORDS = 20
+# SIMHASH_MAX_DISTANCE = 3
+
+# def _simhash(words):
+#     """64-bit SimHash over the set of word 3-grams; near-identical texts differ in only a few bits."""
+#     # Shingles are counted once each, so common words cannot outvote the content.
+#     # Tally them per (byte position, byte value) first, so each shingle costs
+#     # 8 updates instead of 64 per-bit ones; bit weights are summed from the tallies.
+#     shingles = {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+#     tallies = [[0] * 256 for _ in range(8)]
+#     for shingle in shingles:
+#         for pos, value in enumerate(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()):
+#             tallies[pos][value] += 1
+#     fingerprint = 0
+#     for pos, tally in enumerate(tallies):
+#         for bit in range(8):
+#             ones = sum(count for value, count in enumerate(tally) if value >> bit & 1)
+#             if 2 * ones > len(shingles):
+#                 fingerprint |= 1 << (pos * 8 + bit)
+#     return fingerprint
+
+# def dedupe_chunks(chunks):
+#     """Drop chunks that are near-duplicates of an earlier one or too thin to yield cards.
+
+#     The vocabulary check only applies to multi-chunk documents, so a short upload
+#     still gets sent as a whole.
+#     """
+#     kept = []
+#     seen = []
+#     for chunk in chunks:
+#         words = chunk.lower().split()
+#         if len(chunks) > 1 and len(set(words)) < MIN_UNIQUE_WORDS:
+#             continue
+#         fingerprint = _simhash(words)
+#         if any(bin(fingerprint ^ other).count("1") <= SIMHASH_MAX_DISTANCE for other in seen):
+#             continue
+#         seen.append(fingerprint)
+#         kept.append(chunk)
+#     if chunks and not kept:
+#         # Everything looked thin; still send something rather than return no cards
+#         kept = chunks[:1]
+#     if len(kept) < len(chunks):
+#         logger.info(f"Skipped {len(chunks) - len(kept)} duplicate or low-content chunks")
+#     return kept
+
+# async def generate_flashcards_async(text, api_key, on_flashcards=None):
+#     """Generate flashcards for every chunk of `text`.
+
+#     Completions are streamed; if `on_flashcards` is given it is called with each
+#     batch of cards as soon as they close in the stream (or come from the cache).
+#     An exception raised by `on_flashcards` cancels the remaining chunks and
+#     propagates.
+#     """
+#     client = get_client(api_key)
+
+#     chunks = dedupe_chunks(list(iter_chunks_by_sentence(text, chunk_char_budget(text))))
+#     all_flashcards = [] 
+
+#     keys = [_chunk_key(chunk) for chunk in chunks]
+#     sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+#     async def run(i, chunk, key):
+#         """Return (flashcards, complete) for one chunk, or (error, False) if the request failed.
+
+#         Only a stream that reached its finish_reason without an error is complete;
+#         anything else is still returned but never cached.
+#         """
+#         cached = _cache_get(key)
+#         if cached is not None:
+#             logger.info(f"Chunk {i}: cache hit")
+#             if on_flashcards:
+#                 on_flashcards([{"question": q, "answer": a} for q, a in cached])
+#             return cached, False
+#         async with sem:
 #             logger.info(f"Processing chunk {i}/{len(chunks)} ({len(chunk)} chars)")
-#             formatted_prompt =  prompt_template  + chunk
-#             response = client.chat.completions.create(
-#                 model = "gpt-4o",
-#                 temperature = 0.3,
-#                 max_tokens = 4000,
-#                 response_format = {"type":"json_object"},
-#                 messages = [
-#                 {"role": "user", "content": formatted_prompt}
-#                 ]
-#                 )
-                                
-#             raw = response.choices[0].message.content.strip()
+#             try:
+#                 stream = await client.chat.completions.create(
+#                     model = MODEL,
+#                     temperature = 0.3,
+#                     max_tokens = 4000,
+#                     response_format = FLASHCARD_RESPONSE_FORMAT,
+#                     messages = [
+#                     SYSTEM_MESSAGE,
+#                     {"role": "user", "content": "Text:\n" + chunk}
+#                     ],
+#                     stream = True
+#                     )
+#             except Exception as e:
+#                 return e, False
+#             parser = FlashcardStreamParser()
+#             streamed = []
+#             complete = False
+#             events = stream.__aiter__()
+#             while True:
+#                 # Only reading the stream is guarded; errors raised by on_flashcards
+#                 # (the client went away) propagate and abort the whole request
+#                 try:
+#                     event = await events.__anext__()
+#                 except StopAsyncIteration:
+#                     break
+#                 except Exception as e:
+#                     # Cards already handed to on_flashcards must stay in the result
+#                     if not streamed:
+#                         return e, False
+#                     logger.warning(f"Chunk {i}: stream ended early - {type(e).__name__}: {e}")
+#                     break
+#                 if not event.choices:
+#                     continue
+#                 if event.choices[0].finish_reason:
+#                     complete = True
+#                 if not event.choices[0].delta.content:
+#                     continue
+#                 cards = parser.feed(event.choices[0].delta.content)
+#                 if cards:
+#                     streamed.extend(cards)
+#                     if on_flashcards:
+#                         on_flashcards(cards)
+#             # Cards that closed in the stream survive a completion cut off at
+#             # max_tokens; the whole text is only parsed if none did
+#             if streamed:
+#                 return streamed, complete
+#             raw = parser.buffer.strip()
 #             if raw.startswith("```"):
 #                 raw = re.sub(r"^```(json)?", "", raw)
 #                 raw = raw.replace("```", "").strip()
 #             logger.info(f"Raw response from API: {raw[:500]}") 
             
 #             try:
-#                 data = json.loads(raw)
-#             except:
-#                 logger.warning(f"Chunk {i}: JSON decode failed, trying fallback")
-#                 cleaned = re.sub(r",(\s*[}\]])", r"\1", raw) 
-#                 data = json.loads(cleaned)
-                
-            
-#             logger.debug(f"Parsed JSON keys: {list(data.keys())}")
-#             if "flashcards" not in data:
-#                 logger.warning(f"Chunk {i}: Response missing 'flashcards' key. Keys found: {list(data.keys())}")
-#                 continue
-            
-#             flashcards_raw = data["flashcards"]
-#             if not isinstance(flashcards_raw, list):
-#                 logger.warning(f"Chunk {i}: 'flashcards' is not a list, got {type(flashcards_raw)}")
-#                 continue
-#             # if not filter_valid_flashcards(flashcards_raw):
-#             #     logger.warning(f"Chunk {i}: Invalid flashcard structure")
-#             #     continue
-#             flashcards = safe_parse_flashcards(flashcards_raw)
-#             if flashcards:  # Only add if we got valid flashcards
-#                 all_flashcards.extend(flashcards)
-#                 logger.info(f"Chunk {i}: Generated {len(flashcards)} flashcards")
-#             else:
-#                 logger.warning(f"Chunk {i}: No valid flashcards generated")
-#         except json.JSONDecodeError as e:
-#             logger.error(f"Chunk {i}: JSON decode error - {e}")
-#             logger.error(f"Raw response was: {raw[:500]}")
+#                 parsed = FlashcardList.model_validate_json(raw)
+#             except ValidationError:
+#                 logger.warning(f"Chunk {i}: JSON validation failed, trying fallback")
+#                 try:
+#                     parsed = FlashcardList.model_validate_json(clean_json_output(raw))
+#                 except ValidationError as e:
+#                     logger.error(f"Raw response was: {raw[:500]}")
+#                     return e, False
+
+#             flashcards = normalize_flashcards(parsed.flashcards)
+#             if flashcards and on_flashcards:
+#                 on_flashcards(flashcards)
+#             return flashcards, complete
+
+#     tasks = [asyncio.ensure_future(run(i, chunk, key)) for i, (chunk, key) in enumerate(zip(chunks, keys), 1)]
+#     try:
+#         responses = await asyncio.gather(*tasks)
+#     except BaseException:
+#         # Nobody is left to receive the cards, so stop the other chunks too
+#         for task in tasks:
+#             task.cancel()
+#         raise
+
+#     for i, ((response, complete), key) in enumerate(zip(responses, keys), 1):
+#         if isinstance(response, ValidationError):
+#             logger.error(f"Chunk {i}: Flashcard validation error - {response}")
 #             continue
-#         except Exception as e:
-#                 logger.error(f"Chunk {i}: Unexpected error - {type(e).__name__}: {e}")
-#                 import traceback
-#                 logger.error(traceback.format_exc())
-#                 continue
+#         if isinstance(response, BaseException):
+#             logger.error(f"Chunk {i}: Unexpected error - {type(response).__name__}: {response}", exc_info=response)
+#             continue
+#         if isinstance(response, tuple):
+#             all_flashcards.extend({"question": q, "answer": a} for q, a in response)
+#             continue
+#         if response:  # Only add if we got valid flashcards
+#             if complete:  # A cut-off stream is retried next time rather than cached
+#                 _cache_put(key, response)
+#             all_flashcards.extend(response)
+#             logger.info(f"Chunk {i}: Generated {len(response)} flashcards")
+#         else:
+#             logger.warning(f"Chunk {i}: No valid flashcards generated")
 #     return all_flashcards
+
+# def generate_flashcards(text, api_key, on_flashcards=None):
+#     """Run generate_flashcards_async on the shared event loop and wait for the result.
+
+#     `on_flashcards` is called on the calling thread, so a slow client never
+#     blocks the loop other requests share. If it raises, generation is cancelled.
+#     """
+#     batches = queue.SimpleQueue()
+#     future = asyncio.run_coroutine_threadsafe(
+#         generate_flashcards_async(text, api_key, batches.put if on_flashcards else None),
+#         _EVENT_LOOP,
+#     )
+#     future.add_done_callback(lambda _: batches.put(None))
+#     try:
+#         for cards in iter(batches.get, None):
+#             on_flashcards(cards)
+#     except BaseException:
+#         future.cancel()
+#         raise
+#     return future.result()
            
 # # ----- Core handler logic -----
-# def lambda_handler(event):
+# def lambda_handler(event, on_flashcards=None):
 #     try:
 #         if event["httpMethod"] == "OPTIONS":
 #             return {
@@ -229,14 +639,14 @@
 #                     "Access-Control-Allow-Methods": "POST, OPTIONS",
 #                     "Access-Control-Allow-Headers": "Content-Type",
 #                 },
-#                 "body": ""
+#                 "body": b""
 #             }
 
 #         if event["httpMethod"] != "POST":
 #             return {
 #                 "statusCode": 405,
 #                 "headers": {"Content-Type": "application/json"},
-#                 "body": json.dumps({"success": False, "error": "Method not allowed"})
+#                 "body": orjson.dumps({"success": False, "error": "Method not allowed"})
 #             }
 
 #         # Get OpenAI API key
@@ -245,7 +655,7 @@
 #             return {
 #                 "statusCode": 500,
 #                 "headers": {"Content-Type": "application/json"},
-#                 "body": json.dumps({"success": False, "error": "OpenAI API key not configured"})
+#                 "body": orjson.dumps({"success": False, "error": "OpenAI API key not configured"})
 #             }
 
 #         # Normalize headers (case-insensitive)
@@ -255,13 +665,22 @@
 #             return {
 #                 "statusCode": 400,
 #                 "headers": {"Content-Type": "application/json"},
-#                 "body": json.dumps({"success": False, "error": "Content-Type must be application/json"})
+#                 "body": orjson.dumps({"success": False, "error": "Content-Type must be application/json"})
 #             }
 
-#         # Parse JSON body
-#         body = json.loads(event["body"])
-#         file_content = base64.b64decode(body["file_content"])
+#         # Parse JSON body. The raw body and the base64 string are each ~1.33x the
+#         # file size, so drop them as soon as the file bytes are decoded.
+#         body = orjson.loads(event.pop("body"))
 #         file_type = body["file_type"]
+#         try:
+#             file_content = base64.b64decode(body.pop("file_content"), validate=True)
+#         except (ValueError, TypeError):
+#             return {
+#                 "statusCode": 400,
+#                 "headers": {"Content-Type": "application/json"},
+#                 "body": orjson.dumps({"success": False, "error": "file_content is not valid base64"})
+#             }
+#         del body
 
 #         # Extract text
 #         if file_type == "application/pdf":
@@ -276,32 +695,32 @@
 #             return {
 #                 "statusCode": 400,
 #                 "headers": {"Content-Type": "application/json"},
-#                 "body": json.dumps({"success": False, "error": "Unsupported file type"})
+#                 "body": orjson.dumps({"success": False, "error": "Unsupported file type"})
 #             }
 #         if isinstance(text, dict) and "error" in text:
 #             return {
 #             "statusCode": 400,
 #             "headers": { "Content-Type": "application/json",
 #                     "Access-Control-Allow-Origin": "*"},
-#             "body": json.dumps({ "success": False, **text })
+#             "body": orjson.dumps({ "success": False, **text })
 #             }
 
 #         if not text.strip():
 #             return {
 #                 "statusCode": 400,
 #                 "headers": {"Content-Type": "application/json"},
-#                 "body": json.dumps({"success": False, "error": "Could not extract text from file"})
+#                 "body": orjson.dumps({"success": False, "error": "Could not extract text from file"})
 #             }
 
 #         # Generate flashcards
-#         flashcards = generate_flashcards(text, api_key)
+#         flashcards = generate_flashcards(text, api_key, on_flashcards)
 #         return {
 #             "statusCode": 200,
 #             "headers": {
 #                 "Content-Type": "application/json",
 #                 "Access-Control-Allow-Origin": "*"
 #             },
-#             "body": json.dumps({
+#             "body": orjson.dumps({
 #                 "success": True,
 #                 "flashcards": flashcards,
 #                 "count": len(flashcards)
@@ -318,7 +737,7 @@
 #                 "Content-Type": "application/json",
 #                 "Access-Control-Allow-Origin": "*"
 #             },
-#             "body": json.dumps({
+#             "body": orjson.dumps({
 #                 "success": False,
 #                 "error": str(e),
 #                 "trace": traceback.format_exc()
@@ -327,28 +746,109 @@
 
 
 # # ----- Vercel entrypoint -----
+# MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
 # class handler(BaseHTTPRequestHandler):
+#     # Buffer writes so the status line, headers and body leave in a single send
+#     # (flushed after each request), and keep the connection alive between requests.
+#     wbufsize = -1
+#     protocol_version = "HTTP/1.1"
+#     # Close idle keep-alive connections so one client cannot hold the server
+#     timeout = 5
+
+#     def handle_expect_100(self):
+#         # Send "100 Continue" now instead of leaving it in the write buffer
+#         result = super().handle_expect_100()
+#         self.wfile.flush()
+#         return result
+
+#     def send_lambda_response(self, response):
+#         body = response["body"]
+#         self.send_response(response["statusCode"])
+#         for k, v in response.get("headers", {}).items():
+#             self.send_header(k, v)
+#         self.send_header("Content-Length", str(len(body)))
+#         self.end_headers()
+#         self.wfile.write(body)
+
+#     def reject_upload(self, status_code, error):
+#         # Sent before the body is read; the unread body makes the connection
+#         # unusable, so close it afterwards
+#         self.close_connection = True
+#         self.send_lambda_response({
+#             "statusCode": status_code,
+#             "headers": {
+#                 "Content-Type": "application/json",
+#                 "Access-Control-Allow-Origin": "*"
+#             },
+#             "body": orjson.dumps({"success": False, "error": error})
+#         })
+
 #     def do_POST(self):
-#         content_length = int(self.headers.get("Content-Length", 0))
-#         body = self.rfile.read(content_length).decode("utf-8")
+#         try:
+#             content_length = int(self.headers["Content-Length"])
+#         except (TypeError, ValueError):
+#             content_length = -1
+#         # A negative length would make rfile.read() wait for EOF on a kept-alive connection
+#         if content_length < 0:
+#             self.reject_upload(400, "Missing or invalid Content-Length")
+#             return
+#         if content_length > MAX_UPLOAD_BYTES:
+#             self.reject_upload(413, f"Upload too large. Max allowed: {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+#             return
+#         # orjson parses bytes directly, so the body is not decoded first
 #         event = {
 #             "httpMethod": "POST",
 #             "headers": dict(self.headers),
-#             "body": body
+#             "body": self.rfile.read(content_length)
 #         }
-#         response = lambda_handler(event)
-
-#         self.send_response(response["statusCode"])
-#         for k, v in response.get("headers", {}).items():
-#             self.send_header(k, v)
-#         self.end_headers()
-#         self.wfile.write(response["body"].encode())
+#         if "text/event-stream" in self.headers.get("Accept", ""):
+#             self.stream_lambda_response(event)
+#         else:
+#             response = lambda_handler(event)
+#             self.send_lambda_response(response)
+
+#     def stream_lambda_response(self, event):
+#         """Send flashcards as server-sent events as soon as each one is generated.
+
+#         Each card is a `data:` event; a final `done` event carries the summary.
+#         If nothing was streamed (validation error, no cards) the regular JSON
+#         response is sent instead.
+#         """
+#         started = False
+#         disconnected = False
+
+#         def on_flashcards(cards):
+#             nonlocal started, disconnected
+#             if not started:
+#                 self.send_response(200)
+#                 self.send_header("Content-Type", "text/event-stream")
+#                 self.send_header("Cache-Control", "no-cache")
+#                 self.send_header("Access-Control-Allow-Origin", "*")
+#                 self.send_header("Connection", "close")
+#                 self.end_headers()
+#                 self.close_connection = True
+#                 started = True
+#             try:
+#                 for card in cards:
+#                     self.wfile.write(b"data: " + orjson.dumps(card) + b"\n\n")
+#                 self.wfile.flush()
+#             except OSError:
+#                 # The client went away; raising aborts generation for every chunk
+#                 disconnected = True
+#                 raise
+
+#         response = lambda_handler(event, on_flashcards)
+#         if disconnected:
+#             return
+#         if not started:
+#             self.send_lambda_response(response)
+#             return
+#         summary = orjson.loads(response["body"])
+#         summary.pop("flashcards", None)
+#         self.wfile.write(b"event: done\ndata: " + orjson.dumps(summary) + b"\n\n")
 
 #     def do_OPTIONS(self):
 #         response = lambda_handler({"httpMethod": "OPTIONS", "headers": {}, "body": ""})
-#         self.send_response(response["statusCode"])
-#         for k, v in response.get("headers", {}).items():
-#             self.send_header(k, v)
-#         self.end_headers()
-#         self.wfile.write(response["body"].encode())
+#         self.send_lambda_response(response)
 
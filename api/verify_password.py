@@ -1,4 +1,5 @@
-import json
+import hmac
+import orjson
 import os
 from http.server import BaseHTTPRequestHandler
 
@@ -12,14 +13,14 @@ def lambda_handler(event):
                     "Access-Control-Allow-Methods": "POST, OPTIONS",
                     "Access-Control-Allow-Headers": "Content-Type",
                 },
-                "body": ""
+                "body": b""
             }
 
         if event["httpMethod"] != "POST":
             return {
                 "statusCode": 405,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({"success": False, "error": "Method not allowed"})
+                "body": orjson.dumps({"success": False, "error": "Method not allowed"})
             }
 
         correct_password = os.environ.get("APP_PASSWORD")
@@ -28,22 +29,22 @@ def lambda_handler(event):
             return {
                 "statusCode": 500,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({"success": False, "error": "Password not configured"})
+                "body": orjson.dumps({"success": False, "error": "Password not configured"})
             }
 
         # Parse the request body
-        body = json.loads(event["body"])
+        body = orjson.loads(event["body"])
         entered_password = body.get("password", "")
 
         # Check password
-        if entered_password == correct_password:
+        if isinstance(entered_password, str) and hmac.compare_digest(entered_password.encode("utf-8"), correct_password.encode("utf-8")):
             return {
                 "statusCode": 200,
                 "headers": {
                     "Content-Type": "application/json",
                     "Access-Control-Allow-Origin": "*"
                 },
-                "body": json.dumps({"success": True, "authenticated": True})
+                "body": orjson.dumps({"success": True, "authenticated": True})
             }
         else:
             return {
@@ -52,7 +53,7 @@ def lambda_handler(event):
                     "Content-Type": "application/json",
                     "Access-Control-Allow-Origin": "*"
                 },
-                "body": json.dumps({"success": False, "authenticated": False})
+                "body": orjson.dumps({"success": False, "authenticated": False})
             }
 
     except Exception as e:
@@ -62,32 +63,46 @@ def lambda_handler(event):
                 "Content-Type": "application/json",
                 "Access-Control-Allow-Origin": "*"
             },
-            "body": json.dumps({"success": False, "error": str(e)})
+            "body": orjson.dumps({"success": False, "error": str(e)})
         }
 
 
 # Vercel entrypoint
 class handler(BaseHTTPRequestHandler):
+    # Buffer writes so the status line, headers and body leave in a single send
+    # (flushed after each request), and keep the connection alive between requests.
+    wbufsize = -1
+    protocol_version = "HTTP/1.1"
+    # Close idle keep-alive connections so one client cannot hold the server
+    timeout = 5
+
+    def handle_expect_100(self):
+        # Send "100 Continue" now instead of leaving it in the write buffer
+        result = super().handle_expect_100()
+        self.wfile.flush()
+        return result
+
+    def send_lambda_response(self, response):
+        body = response["body"]
+        self.send_response(response["statusCode"])
+        for k, v in response.get("headers", {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_POST(self):
         content_length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(content_length).decode("utf-8")
+        # orjson parses bytes directly, so the body is not decoded first
+        body = self.rfile.read(content_length)
         event = {
             "httpMethod": "POST",
             "headers": dict(self.headers),
             "body": body
         }
         response = lambda_handler(event)
-
-        self.send_response(response["statusCode"])
-        for k, v in response.get("headers", {}).items():
-            self.send_header(k, v)
-        self.end_headers()
-        self.wfile.write(response["body"].encode())
+        self.send_lambda_response(response)
 
     def do_OPTIONS(self):
         response = lambda_handler({"httpMethod": "OPTIONS", "headers": {}, "body": ""})
-        self.send_response(response["statusCode"])
-        for k, v in response.get("headers", {}).items():
-            self.send_header(k, v)
-        self.end_headers()
-        self.wfile.write(response["body"].encode())
+        self.send_lambda_response(response)